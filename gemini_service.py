@@ -3,15 +3,45 @@
 Gemini Service for CineSpark - handles AI chat with context support
 """
 
+import asyncio
+import functools
 import google.generativeai as genai
 import os
 import logging
-from typing import List, Dict, Optional
+from collections import deque
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Deque, List, Dict, Optional, Set, Tuple
 from datetime import datetime
 from character_prompts import format_message_with_character, get_available_characters, get_character_name
 
 logger = logging.getLogger(__name__)
 
+# Gemini role names for history roles that are sent as chat context
+CONTEXT_ROLES = {'user': 'user', 'assistant': 'model'}
+
+@dataclass(frozen=True)
+class HistoryEntry:
+    """Single conversation history entry"""
+    __slots__ = ('role', 'content', 'timestamp')
+    
+    role: str
+    content: str
+    timestamp: str
+    
+    def to_dict(self) -> Dict:
+        """Convert entry to a plain dict for API responses"""
+        return {'role': self.role, 'content': self.content, 'timestamp': self.timestamp}
+
+@functools.lru_cache(maxsize=1)
+def _load_api_key() -> str:
+    """Read the Gemini API key from key/gemini.key (cached after the first read)"""
+    key_file = os.path.join(os.path.dirname(__file__), 'key', 'gemini.key')
+    try:
+        with open(key_file, 'r') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        raise ValueError(f"API key file not found: {key_file}")
+
 class GeminiService:
     """Gemini AI service for chat functionality"""
     
@@ -19,12 +49,7 @@ class GeminiService:
         """Initialize Gemini service with API key"""
         if api_key is None:
             # Read API key from file
-            key_file = os.path.join(os.path.dirname(__file__), 'key', 'gemini.key')
-            try:
-                with open(key_file, 'r') as f:
-                    api_key = f.read().strip()
-            except FileNotFoundError:
-                raise ValueError(f"API key file not found: {key_file}")
+            api_key = _load_api_key()
         
         if not api_key:
             raise ValueError("Gemini API key is required")
@@ -45,12 +70,24 @@ class GeminiService:
             generation_config=generation_config
         )
         
-        # Store conversation history
-        self.conversation_history: List[Dict] = []
-        
         # Maximum history length to prevent context overflow
         self.max_history_length = 50
         
+        # Store conversation history (oldest entries are evicted automatically)
+        self.conversation_history: Deque[HistoryEntry] = deque(maxlen=self.max_history_length)
+        
+        # Gemini-formatted context for the user/assistant entries in conversation_history
+        self._context_cache: Deque[Dict] = deque()
+        
+        # Serializes chat turns so each user/assistant pair lands in history together
+        self._turn_lock = asyncio.Lock()
+        
+        # Bumped by clear_history so an in-flight turn doesn't append to a cleared history
+        self._history_generation = 0
+        
+        # Streamed turns still running, referenced so they finish even if the reader is gone
+        self._stream_turns: Set[asyncio.Task] = set()
+        
         # Current character ID for responses (1=標叔, 2=雷達標, 3=味全師傅)
         self.current_character_id = 1
         
@@ -58,42 +95,37 @@ class GeminiService:
     
     def add_to_history(self, role: str, content: str):
         """Add message to conversation history"""
-        self.conversation_history.append({
-            'role': role,
-            'content': content,
-            'timestamp': datetime.now().isoformat()
-        })
+        # The deque evicts its oldest entry when full; drop its formatted context too
+        if len(self.conversation_history) == self.conversation_history.maxlen:
+            if self.conversation_history[0].role in CONTEXT_ROLES:
+                self._context_cache.popleft()
+        
+        self.conversation_history.append(HistoryEntry(role, content, datetime.now().isoformat()))
         
-        # Trim history if it gets too long
-        if len(self.conversation_history) > self.max_history_length:
-            self.conversation_history = self.conversation_history[-self.max_history_length:]
+        # Keep the formatted context in step so it never has to be rebuilt
+        gemini_role = CONTEXT_ROLES.get(role)
+        if gemini_role:
+            self._context_cache.append({'role': gemini_role, 'parts': [content]})
+    
+    def _discard_last_message(self):
+        """Remove the most recent history entry (a user message left without a reply)"""
+        if self.conversation_history.pop().role in CONTEXT_ROLES:
+            self._context_cache.pop()
     
     def get_context_messages(self) -> List[Dict]:
         """Get formatted context messages for Gemini"""
-        context_messages = []
-        
-        for msg in self.conversation_history:
-            if msg['role'] == 'user':
-                context_messages.append({
-                    'role': 'user',
-                    'parts': [msg['content']]
-                })
-            elif msg['role'] == 'assistant':
-                context_messages.append({
-                    'role': 'model',
-                    'parts': [msg['content']]
-                })
-        
-        return context_messages
+        return list(self._context_cache)
     
     def clear_history(self):
         """Clear conversation history"""
         self.conversation_history.clear()
+        self._context_cache.clear()
+        self._history_generation += 1
         logger.info("Conversation history cleared")
     
     def get_history(self) -> List[Dict]:
         """Get conversation history"""
-        return self.conversation_history.copy()
+        return [entry.to_dict() for entry in self.conversation_history]
     
     def set_character(self, character_id: int):
         """Set the current character for responses"""
@@ -117,6 +149,43 @@ class GeminiService:
         """Get list of available characters with their IDs"""
         return get_available_characters()
     
+    def _prepare_request(self, message: str, include_context: bool, character_id: Optional[int]) -> Tuple[Callable, str]:
+        """
+        Resolve the character, record the user message and pick the Gemini call
+        
+        Returns:
+            Tuple of (Gemini send callable, formatted message to send)
+        """
+        # Use specified character ID or current character ID
+        character_to_use = character_id if character_id is not None else self.current_character_id
+        
+        # Update current character ID if a different one is specified
+        if character_id is not None and character_id != self.current_character_id:
+            logger.debug("🎭 GEMINI DEBUG: Updating current_character_id from %s to %s", self.current_character_id, character_id)
+            self.current_character_id = character_id
+        
+        # Debug info for character selection
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("🎭 GEMINI DEBUG: Using character_id=%s", character_to_use)
+            logger.debug("🎭 GEMINI DEBUG: Character name='%s' (ID: %s)", get_character_name(character_to_use), character_to_use)
+        
+        # Format message with character prompt
+        formatted_message = format_message_with_character(message, character_to_use)
+        logger.debug("🎭 GEMINI DEBUG: Formatted message length=%d characters", len(formatted_message))
+        
+        # Add original user message to history (without character prompt)
+        self.add_to_history('user', message)
+        
+        if include_context and len(self.conversation_history) > 1:
+            # Start chat with history
+            context_messages = self.get_context_messages()
+            # Create chat with history (excluding the current user message that was just added)
+            chat = self.model.start_chat(history=context_messages[:-1])
+            return chat.send_message, formatted_message
+        
+        # Simple message without history
+        return self.model.generate_content, formatted_message
+    
     async def send_message(self, message: str, include_context: bool = True, character_id: int = None) -> str:
         """
         Send message to Gemini and get response
@@ -130,55 +199,97 @@ class GeminiService:
             Gemini response text
         """
         try:
-            # Use specified character ID or current character ID
-            character_to_use = character_id if character_id is not None else self.current_character_id
-            
-            # Update current character ID if a different one is specified
-            if character_id is not None and character_id != self.current_character_id:
-                logger.info(f"🎭 GEMINI DEBUG: Updating current_character_id from {self.current_character_id} to {character_id}")
-                self.current_character_id = character_id
-            
-            # Debug info for character selection
-            logger.info(f"🎭 GEMINI DEBUG: Using character_id={character_to_use}")
-            character_name = get_character_name(character_to_use)
-            logger.info(f"🎭 GEMINI DEBUG: Character name='{character_name}' (ID: {character_to_use})")
-            
-            # Format message with character prompt
-            formatted_message = format_message_with_character(message, character_to_use)
-            logger.info(f"🎭 GEMINI DEBUG: Formatted message length={len(formatted_message)} characters")
-            
-            # Add original user message to history (without character prompt)
-            self.add_to_history('user', message)
-            
-            if include_context and len(self.conversation_history) > 1:
-                # Start chat with history
-                context_messages = self.get_context_messages()
-                # Create chat with history (excluding the current user message that was just added)
-                chat = self.model.start_chat(history=context_messages[:-1])
-                response = chat.send_message(formatted_message)
-            else:
-                # Simple message without history
-                response = self.model.generate_content(formatted_message)
+            async with self._turn_lock:
+                send, formatted_message = self._prepare_request(message, include_context, character_id)
+                generation = self._history_generation
+                
+                # The SDK call is blocking HTTP, so keep it off the event loop
+                response = await asyncio.to_thread(send, formatted_message)
+                
+                # Extract response text
+                response_text = response.text
+                
+                # Add assistant response to history (unless it was cleared meanwhile)
+                if generation == self._history_generation:
+                    self.add_to_history('assistant', response_text)
+                
+                return response_text
             
-            # Extract response text
-            response_text = response.text
+        except Exception as e:
+            logger.error(f"❌ GEMINI ERROR: {e}")
+            raise Exception(f"Gemini API error: {str(e)}")
+    
+    async def stream_message(self, message: str, include_context: bool = True, character_id: int = None) -> AsyncIterator[str]:
+        """
+        Send message to Gemini and yield response text as it is generated
+        
+        Args:
+            message: User message
+            include_context: Whether to include conversation history
+            character_id: Character ID to use for response (overrides current character)
             
-            # Add assistant response to history
-            self.add_to_history('assistant', response_text)
+        Yields:
+            Gemini response text chunks
+        """
+        chunks: asyncio.Queue = asyncio.Queue()
+        turn = asyncio.create_task(self._stream_turn(message, include_context, character_id, chunks))
+        self._stream_turns.add(turn)
+        turn.add_done_callback(self._stream_turns.discard)
+        
+        while True:
+            item = await chunks.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    
+    async def _stream_turn(self, message: str, include_context: bool, character_id: Optional[int], chunks: asyncio.Queue):
+        """
+        Run a streamed chat turn under the turn lock, feeding text chunks into a queue
+        
+        The reply is drained at Gemini's pace rather than the reader's, so a slow or
+        disconnected client never holds the turn lock. The queue ends with None, or
+        with the exception that stopped the turn.
+        """
+        try:
+            async with self._turn_lock:
+                send, formatted_message = self._prepare_request(message, include_context, character_id)
+                generation = self._history_generation
+                parts = []
+                try:
+                    # The SDK stream is a blocking iterator, so pull each chunk in a worker thread
+                    response = await asyncio.to_thread(send, formatted_message, stream=True)
+                    stream = iter(response)
+                    while True:
+                        chunk = await asyncio.to_thread(next, stream, None)
+                        if chunk is None:
+                            break
+                        text = chunk.text
+                        parts.append(text)
+                        chunks.put_nowait(text)
+                finally:
+                    # Pair the user message with whatever reply arrived, or drop it if
+                    # nothing did, so history never holds two user turns in a row
+                    if generation == self._history_generation:
+                        if parts:
+                            self.add_to_history('assistant', ''.join(parts))
+                        else:
+                            self._discard_last_message()
             
-            return response_text
+            chunks.put_nowait(None)
             
         except Exception as e:
             logger.error(f"❌ GEMINI ERROR: {e}")
-            raise Exception(f"Gemini API error: {str(e)}")
+            chunks.put_nowait(Exception(f"Gemini API error: {str(e)}"))
     
     def get_conversation_summary(self) -> Dict:
         """Get summary of current conversation"""
         return {
             'total_messages': len(self.conversation_history),
-            'user_messages': len([m for m in self.conversation_history if m['role'] == 'user']),
-            'assistant_messages': len([m for m in self.conversation_history if m['role'] == 'assistant']),
-            'last_message_time': self.conversation_history[-1]['timestamp'] if self.conversation_history else None,
+            'user_messages': len([m for m in self.conversation_history if m.role == 'user']),
+            'assistant_messages': len([m for m in self.conversation_history if m.role == 'assistant']),
+            'last_message_time': self.conversation_history[-1].timestamp if self.conversation_history else None,
             'history_length_limit': self.max_history_length,
             'current_character_id': self.current_character_id,
             'current_character_name': self.get_current_character(),
@@ -5,21 +5,34 @@ HTTP Server for NFC Reader LLM Service
 
 This server provides HTTP API endpoints for LLM chat functionality,
 replacing the WebSocket implementation for better reliability and scalability.
+
+Development: python http_server.py (set HTTP_SERVER_RELOAD=1 for auto-reload)
+Production (a single worker: chat sessions, duplicate checks and the Gemini
+conversation history live in process memory, so extra workers would split them):
+    WEB_CONCURRENCY=1 gunicorn http_server:app -k uvicorn.workers.UvicornWorker \
+        --keep-alive 5 --bind 145.79.12.177:10000
 """
 
 import asyncio
-import json
+import functools
+import importlib.util
 import logging
+import os
+import sys
+import orjson
 import uvicorn
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 from datetime import datetime
-import uuid
+import secrets
 import time
 import hashlib
+import xxhash
+import threading
+from collections import OrderedDict, deque
 from enum import Enum
 
 # Import required services
@@ -70,8 +83,35 @@ gemini_service.preload_character_data()
 
 # In-memory storage for demo purposes
 # In production, use a proper database
-chat_sessions: Dict[str, Dict[str, Any]] = {}
-recent_messages: Dict[str, float] = {}
+# Chat sessions in least-recently-used order, guarded by a lock because
+# synchronous handlers run in the threadpool
+chat_sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+chat_sessions_lock = threading.Lock()
+
+# Session limits: idle sessions expire after the TTL, the least recently used
+# are evicted past the cap, and each session keeps only its latest messages
+MAX_CHAT_SESSIONS = 10_000
+CHAT_SESSION_TTL = 3600.0
+MAX_SESSION_MESSAGES = 200
+# Duplicate-check keys in least-recently-stored order
+recent_messages: "OrderedDict[int, float]" = OrderedDict()
+
+# Maximum number of duplicate-check keys to remember
+MAX_RECENT_MESSAGES = 100
+
+# Upper bound on character IDs resolved by a single batch request
+MAX_CHARACTER_BATCH_SIZE = 100
+
+# Seconds before cached character data is rebuilt from the Feishu cache
+CHARACTER_CACHE_TTL = 60.0
+character_cache_expires_at = 0.0
+
+# Constant health check body, encoded once at import
+ROOT_RESPONSE_BODY = orjson.dumps({"message": "影聲 NFC Reader HTTP API Server", "status": "running"})
+ROOT_RESPONSE_ETAG = f'"{hashlib.md5(ROOT_RESPONSE_BODY).hexdigest()}"'
+
+# Constant ping body for keepalive polling (without the server timestamp)
+PING_RESPONSE_BODY = orjson.dumps({"success": True, "message": "Server is running"})
 
 # Pydantic models for request/response
 class ChatRequest(BaseModel):
@@ -101,6 +141,14 @@ class CharacterResponse(BaseModel):
     success: bool
     error: Optional[str] = None
 
+class CharacterBatchRequest(BaseModel):
+    ids: List[int]
+
+class CharacterBatchResponse(BaseModel):
+    results: Dict[str, CharacterResponse]
+    success: bool
+    error: Optional[str] = None
+
 class ClearHistoryResponse(BaseModel):
     success: bool
     message: str
@@ -158,68 +206,259 @@ class TTSResponse(BaseModel):
     error: Optional[str] = None
 
 # Helper functions
+def _touch_session(connection_id: str, now: float) -> Optional[Dict[str, Any]]:
+    """Return a live session and mark it as recently used (caller holds chat_sessions_lock)"""
+    session = chat_sessions.get(connection_id)
+    if session is None:
+        return None
+    
+    if now - session["last_active"] > CHAT_SESSION_TTL:
+        del chat_sessions[connection_id]
+        return None
+    
+    session["last_active"] = now
+    chat_sessions.move_to_end(connection_id)
+    return session
+
+def get_session(connection_id: str) -> Optional[Dict[str, Any]]:
+    """Get existing chat session for connection, if it has not expired"""
+    with chat_sessions_lock:
+        return _touch_session(connection_id, time.monotonic())
+
 def get_or_create_session(connection_id: str) -> Dict[str, Any]:
     """Get or create chat session for connection"""
-    if connection_id not in chat_sessions:
-        chat_sessions[connection_id] = {
-            "messages": [],
-            "character_id": 1,
-            "created_at": datetime.now()
-        }
-    return chat_sessions[connection_id]
+    now = time.monotonic()
+    with chat_sessions_lock:
+        session = _touch_session(connection_id, now)
+        if session is None:
+            session = {
+                "messages": deque(maxlen=MAX_SESSION_MESSAGES),
+                "character_id": 1,
+                "created_at": datetime.now(),
+                "last_active": now
+            }
+            chat_sessions[connection_id] = session
+        
+        # Drop expired sessions from the front, then enforce the size cap
+        while chat_sessions:
+            oldest = next(iter(chat_sessions.values()))
+            if now - oldest["last_active"] <= CHAT_SESSION_TTL:
+                break
+            chat_sessions.popitem(last=False)
+        while len(chat_sessions) > MAX_CHAT_SESSIONS:
+            chat_sessions.popitem(last=False)
+    
+    return session
 
-def is_duplicate_message(client_id: str, message_type: str, message_data: Dict[str, Any]) -> bool:
+def is_duplicate_message(client_id: str, message_type: str, text: str, character_id: Optional[int]) -> bool:
     """Check if message is duplicate"""
-    # Generate message hash
-    message_hash = hashlib.md5(json.dumps(message_data, sort_keys=True).encode()).hexdigest()
-    message_key = f"{client_id}_{message_type}_{message_hash}"
-    current_time = time.time()
+    # Hash the identifying fields directly (NUL-separated) instead of serializing them
+    hasher = xxhash.xxh3_128()
+    for field in (client_id, message_type, text, str(character_id)):
+        hasher.update(field.encode())
+        hasher.update(b"\x00")
+    message_key = hasher.intdigest()
+    current_time = time.monotonic()
     
     # Check if duplicate within 1 second
     if message_key in recent_messages:
         if current_time - recent_messages[message_key] < 1.0:
             return True
+        # Stale entry: move it to the end (new keys are appended there already)
+        recent_messages.move_to_end(message_key)
     
-    # Store message time
+    # Store message time as the most recent entry
     recent_messages[message_key] = current_time
     
-    # Clean old messages (keep last 100)
-    if len(recent_messages) > 100:
-        old_keys = sorted(recent_messages.keys(), key=lambda k: recent_messages[k])[:50]
-        for key in old_keys:
-            del recent_messages[key]
+    # Evict the oldest messages beyond the limit
+    while len(recent_messages) > MAX_RECENT_MESSAGES:
+        recent_messages.popitem(last=False)
     
     return False
 
+def lookup_character(character_id: int) -> Dict[str, Any]:
+    """Resolve character name and voice for a single character ID"""
+    try:
+        character_name = lookup_character_name(character_id)
+        voice_id = lookup_character_voice_id(character_id)
+        
+        if character_name and character_name != "AI 助手":
+            return {
+                "character_id": character_id,
+                "character_name": character_name,
+                "voice_id": voice_id,
+                "success": True,
+                "error": None
+            }
+        else:
+            return {
+                "character_id": character_id,
+                "character_name": "未知角色",
+                "voice_id": "moss_audio_af916082-2e36-11f0-92db-0e8893cbb430",
+                "success": False,
+                "error": "Character not found"
+            }
+            
+    except Exception as e:
+        logger.error("Character request failed: %s", e)
+        return {
+            "character_id": character_id,
+            "character_name": "錯誤",
+            "voice_id": "moss_audio_af916082-2e36-11f0-92db-0e8893cbb430",
+            "success": False,
+            "error": str(e)
+        }
+
+@functools.lru_cache(maxsize=1)
+def build_character_listings() -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Build the character list and string-keyed character map from the character cache"""
+    character_map = get_available_characters()
+    
+    # Convert dictionary to list of character objects
+    characters = [
+        {"character_id": char_id, "character_name": char_name}
+        for char_id, char_name in character_map.items()
+    ]
+    
+    # Convert integer keys to string keys for JSON compatibility
+    character_map_str = {str(k): v for k, v in character_map.items()}
+    
+    return characters, character_map_str
+
+# Memoized per-character lookups, cleared together with the character listings
+_cached_character_name = functools.lru_cache(maxsize=64)(get_character_name)
+_cached_character_voice_id = functools.lru_cache(maxsize=64)(get_character_voice_id)
+
+def clear_character_caches():
+    """Drop cached character data so the next lookup rebuilds it"""
+    build_character_listings.cache_clear()
+    _cached_character_name.cache_clear()
+    _cached_character_voice_id.cache_clear()
+
+def expire_character_caches():
+    """Clear cached character data once CHARACTER_CACHE_TTL has passed"""
+    global character_cache_expires_at
+    now = time.monotonic()
+    if now >= character_cache_expires_at:
+        clear_character_caches()
+        character_cache_expires_at = now + CHARACTER_CACHE_TTL
+
+def get_character_listings() -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Get cached character list and character map"""
+    expire_character_caches()
+    return build_character_listings()
+
+def lookup_character_name(character_id: int) -> str:
+    """Get cached character name"""
+    expire_character_caches()
+    return _cached_character_name(character_id)
+
+def lookup_character_voice_id(character_id: int) -> str:
+    """Get cached character voice ID"""
+    expire_character_caches()
+    return _cached_character_voice_id(character_id)
+
+def orjson_response(body: Dict[str, Any]) -> Response:
+    """Serialize a body that already has its documented response shape"""
+    return Response(content=orjson.dumps(body), media_type="application/json")
+
+def chat_error_response(error: str) -> Dict[str, Any]:
+    """Build a failed chat response body (same shape as ChatResponse)"""
+    return {
+        "response": "",
+        "voice_id": None,
+        "character_id": None,
+        "character_name": None,
+        "success": False,
+        "error": error,
+        "timestamp": None,
+        "connection_id": None
+    }
+
+def finish_chat_reply(request: ChatRequest, session: Dict[str, Any], character_id: int, response_text: str) -> Dict[str, Any]:
+    """Store the AI reply in the session and build the chat response"""
+    # Get character info
+    character_name = lookup_character_name(character_id)
+    voice_id = lookup_character_voice_id(character_id)
+    
+    # Store AI response (one timestamp shared with the response below)
+    response_time = datetime.now().isoformat()
+    ai_message = {
+        "text": response_text,
+        "is_user": False,
+        "timestamp": response_time,
+        "is_error": False
+    }
+    session["messages"].append(ai_message)
+    
+    return {
+        "response": response_text,
+        "voice_id": voice_id,
+        "character_id": character_id,
+        "character_name": character_name,
+        "success": True,
+        "error": None,
+        "timestamp": response_time,
+        "connection_id": request.connection_id
+    }
+
+async def stream_chat_reply(request: ChatRequest, session: Dict[str, Any], character_id: int):
+    """Yield the Gemini reply as NDJSON: one {"delta": ...} line per chunk, then the full chat response"""
+    parts = []
+    try:
+        async for chunk in gemini_service.stream_message(
+            message=request.text,
+            include_context=True,
+            character_id=character_id
+        ):
+            parts.append(chunk)
+            yield orjson.dumps({"delta": chunk}) + b"\n"
+        
+        response_text = "".join(parts)
+        logger.info("✅ LLM stream finished: %s...", response_text[:100])
+        
+        yield orjson.dumps(finish_chat_reply(request, session, character_id, response_text)) + b"\n"
+        
+    except Exception as e:
+        logger.error("Chat stream failed: %s", e)
+        yield orjson.dumps(chat_error_response(str(e))) + b"\n"
+
 @app.get("/")
 async def root():
     """Health check endpoint"""
-    return {"message": "影聲 NFC Reader HTTP API Server", "status": "running"}
+    return Response(
+        content=ROOT_RESPONSE_BODY,
+        media_type="application/json",
+        headers={"ETag": ROOT_RESPONSE_ETAG}
+    )
 
 @app.get("/api/ping")
-async def ping():
-    """Ping endpoint for connection testing"""
-    return PingResponse(
-        success=True,
-        message="Server is running",
-        timestamp=datetime.now().isoformat()
-    )
+async def ping(ts: bool = False):
+    """Ping endpoint for connection testing (pass ts=1 to include the server time)"""
+    if ts:
+        return PingResponse(
+            success=True,
+            message="Server is running",
+            timestamp=datetime.now().isoformat()
+        )
+    
+    return Response(content=PING_RESPONSE_BODY, media_type="application/json")
 
 @app.post("/api/session/new", response_model=NewSessionResponse)
 async def create_new_session(request: CharacterRequest):
     """Create a new chat session (for new NFC scan)"""
     try:
-        # Generate new connection ID
-        connection_id = str(uuid.uuid4())
+        # Generate new connection ID (128 random bits, it also guards history access)
+        connection_id = secrets.token_hex(16)
 
         # Create new session
         session = get_or_create_session(connection_id)
         session["character_id"] = request.character_id
 
         # Get character info
-        character_name = get_character_name(request.character_id)
+        character_name = lookup_character_name(request.character_id)
 
-        logger.info(f"✅ New session created: {connection_id} for character {character_name}")
+        logger.info("✅ New session created: %s for character %s", connection_id, character_name)
 
         return NewSessionResponse(
             connection_id=connection_id,
@@ -230,7 +469,7 @@ async def create_new_session(request: CharacterRequest):
         )
 
     except Exception as e:
-        logger.error(f"Failed to create new session: {str(e)}")
+        logger.error("Failed to create new session: %s", e)
         return NewSessionResponse(
             connection_id="",
             character_id=request.character_id,
@@ -240,27 +479,18 @@ async def create_new_session(request: CharacterRequest):
             error=str(e)
         )
 
-@app.post("/api/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+@app.post("/api/chat", response_model=None, responses={200: {"model": ChatResponse}})
+async def chat(request: ChatRequest, http_request: Request):
     """Main chat endpoint for LLM queries"""
     try:
-        logger.info(f"Received chat request: {request.type} - {request.text[:50]}...")
+        logger.info("Received chat request: %s - %s...", request.type, request.text[:50])
         
         # Check for duplicate messages
         client_id = request.connection_id or "anonymous"
-        message_data = {
-            "type": request.type,
-            "text": request.text,
-            "character_id": request.character_id
-        }
         
-        if is_duplicate_message(client_id, request.type, message_data):
-            logger.warning(f"Duplicate message detected: {request.type}")
-            return ChatResponse(
-                response="",
-                success=False,
-                error="Duplicate message"
-            )
+        if is_duplicate_message(client_id, request.type, request.text, request.character_id):
+            logger.warning("Duplicate message detected: %s", request.type)
+            return orjson_response(chat_error_response("Duplicate message"))
         
         # Get or create session
         if request.connection_id:
@@ -268,15 +498,10 @@ async def chat(request: ChatRequest):
             session = get_or_create_session(request.connection_id)
             if request.character_id:
                 session["character_id"] = request.character_id
-            current_connection_id = request.connection_id
         else:
             # No connection_id provided - this is required
             logger.error("❌ No connection_id provided in chat request")
-            return ChatResponse(
-                response="",
-                success=False,
-                error="connection_id is required for chat"
-            )
+            return orjson_response(chat_error_response("connection_id is required for chat"))
         
         # Store user message
         user_message = {
@@ -289,96 +514,71 @@ async def chat(request: ChatRequest):
         
         # Generate LLM response
         if request.type in ["text", "gemini_chat"]:
-            # Update Gemini Service character if needed
-            if request.character_id and request.character_id != gemini_service.get_current_character_id():
-                gemini_service.set_character(request.character_id)
+            # Resolve the character once; send_message switches Gemini to it if needed
+            character_id = request.character_id or gemini_service.get_current_character_id()
             
-            logger.info(f"🚀 Starting LLM request for: {request.text[:50]}...")
+            logger.info("🚀 Starting LLM request for: %s...", request.text[:50])
+            
+            # Stream only to clients that can read NDJSON; older app builds send
+            # streaming=true but decode a single JSON response
+            accept = http_request.headers.get("accept", "")
+            if request.streaming and "application/x-ndjson" in accept:
+                return StreamingResponse(
+                    stream_chat_reply(request, session, character_id),
+                    media_type="application/x-ndjson"
+                )
 
             response_text = await gemini_service.send_message(
                 message=request.text,
                 include_context=True,
-                character_id=request.character_id
+                character_id=character_id
             )
 
-            logger.info(f"✅ LLM response received: {response_text[:100]}...")
+            logger.info("✅ LLM response received: %s...", response_text[:100])
 
-            # Get character info
-            character_id = request.character_id or gemini_service.get_current_character_id()
-            character_name = get_character_name(character_id)
-            voice_id = get_character_voice_id(character_id)
-            
-            # Store AI response
-            ai_message = {
-                "text": response_text,
-                "is_user": False,
-                "timestamp": datetime.now().isoformat(),
-                "is_error": False
-            }
-            session["messages"].append(ai_message)
-            
-            return ChatResponse(
-                response=response_text,
-                voice_id=voice_id,
-                character_id=character_id,
-                character_name=character_name,
-                success=True,
-                timestamp=datetime.now().isoformat(),
-                connection_id=current_connection_id
-            )
+            return orjson_response(finish_chat_reply(request, session, character_id, response_text))
             
         else:
             raise HTTPException(status_code=400, detail=f"Unsupported message type: {request.type}")
             
     except Exception as e:
-        logger.error(f"Chat request failed: {str(e)}")
-        return ChatResponse(
-            response="",
-            success=False,
-            error=str(e)
-        )
+        logger.error("Chat request failed: %s", e)
+        return orjson_response(chat_error_response(str(e)))
 
-@app.post("/api/character", response_model=CharacterResponse)
-async def get_character_info(request: CharacterRequest):
+@app.post("/api/character", response_model=None, responses={200: {"model": CharacterResponse}})
+def get_character_info(request: CharacterRequest):
     """Get character information"""
-    try:
-        character_name = get_character_name(request.character_id)
-        voice_id = get_character_voice_id(request.character_id)
-        
-        if character_name and character_name != "AI 助手":
-            return CharacterResponse(
-                character_id=request.character_id,
-                character_name=character_name,
-                voice_id=voice_id,
-                success=True
-            )
-        else:
-            return CharacterResponse(
-                character_id=request.character_id,
-                character_name="未知角色",
-                voice_id="moss_audio_af916082-2e36-11f0-92db-0e8893cbb430",
-                success=False,
-                error="Character not found"
-            )
-            
-    except Exception as e:
-        logger.error(f"Character request failed: {str(e)}")
-        return CharacterResponse(
-            character_id=request.character_id,
-            character_name="錯誤",
-            voice_id="moss_audio_af916082-2e36-11f0-92db-0e8893cbb430",
+    return orjson_response(lookup_character(request.character_id))
+
+@app.post("/api/characters/batch", response_model=CharacterBatchResponse)
+async def get_characters_batch(request: CharacterBatchRequest):
+    """Get information for several characters in one request"""
+    if len(request.ids) > MAX_CHARACTER_BATCH_SIZE:
+        return CharacterBatchResponse(
+            results={},
             success=False,
-            error=str(e)
+            error=f"At most {MAX_CHARACTER_BATCH_SIZE} ids per batch"
         )
+    
+    # Resolve unique IDs concurrently so Feishu cache misses overlap
+    character_ids = list(dict.fromkeys(request.ids))
+    characters = await asyncio.gather(
+        *(asyncio.to_thread(lookup_character, character_id) for character_id in character_ids)
+    )
+    
+    return CharacterBatchResponse(
+        results={str(character["character_id"]): character for character in characters},
+        success=True
+    )
 
 @app.get("/api/history", response_model=HistoryResponse)
 async def get_history(connection_id: Optional[str] = None):
-    """Get chat history"""
+    """Get chat history (on the event loop, where GeminiService history is mutated)"""
     try:
-        if connection_id and connection_id in chat_sessions:
-            session = chat_sessions[connection_id]
+        session = get_session(connection_id) if connection_id else None
+        if session is not None:
             return HistoryResponse(
-                messages=session["messages"],
+                messages=list(session["messages"]),
                 success=True
             )
         else:
@@ -390,7 +590,7 @@ async def get_history(connection_id: Optional[str] = None):
             )
             
     except Exception as e:
-        logger.error(f"History request failed: {str(e)}")
+        logger.error("History request failed: %s", e)
         return HistoryResponse(
             messages=[],
             success=False,
@@ -399,14 +599,16 @@ async def get_history(connection_id: Optional[str] = None):
 
 @app.post("/api/history/clear", response_model=ClearHistoryResponse)
 async def clear_history(connection_id: Optional[str] = None):
-    """Clear chat history"""
+    """Clear chat history (on the event loop, where GeminiService history is mutated)"""
     try:
-        if connection_id and connection_id in chat_sessions:
-            chat_sessions[connection_id]["messages"] = []
+        session = get_session(connection_id) if connection_id else None
+        if session is not None:
+            session["messages"].clear()
             message = "Session history cleared successfully"
         else:
             # Clear all sessions and Gemini history
-            chat_sessions.clear()
+            with chat_sessions_lock:
+                chat_sessions.clear()
             gemini_service.clear_history()
             message = "All history cleared successfully"
             
@@ -416,7 +618,7 @@ async def clear_history(connection_id: Optional[str] = None):
         )
         
     except Exception as e:
-        logger.error(f"Clear history failed: {str(e)}")
+        logger.error("Clear history failed: %s", e)
         return ClearHistoryResponse(
             success=False,
             message="Failed to clear history",
@@ -424,16 +626,10 @@ async def clear_history(connection_id: Optional[str] = None):
         )
 
 @app.get("/api/characters", response_model=CharactersResponse)
-async def list_characters():
+def list_characters():
     """List all available characters"""
     try:
-        characters_dict = gemini_service.get_available_characters()
-        
-        # Convert dictionary to list of character objects
-        characters = [
-            {"character_id": char_id, "character_name": char_name}
-            for char_id, char_name in characters_dict.items()
-        ]
+        characters, _ = get_character_listings()
         
         return CharactersResponse(
             characters=characters,
@@ -443,7 +639,7 @@ async def list_characters():
         )
         
     except Exception as e:
-        logger.error(f"List characters failed: {str(e)}")
+        logger.error("List characters failed: %s", e)
         return CharactersResponse(
             characters=[],
             current_character_id=1,
@@ -454,7 +650,7 @@ async def list_characters():
 
 @app.post("/api/character/set")
 async def set_character(request: CharacterRequest):
-    """Set current character"""
+    """Set current character (on the event loop, where GeminiService state is mutated)"""
     try:
         character_id = request.character_id
         
@@ -477,20 +673,17 @@ async def set_character(request: CharacterRequest):
         }
         
     except Exception as e:
-        logger.error(f"Set character failed: {str(e)}")
+        logger.error("Set character failed: %s", e)
         return {
             "success": False,
             "error": str(e)
         }
 
 @app.get("/api/character/map", response_model=CharacterMapResponse)
-async def get_character_map():
+def get_character_map():
     """Get character map for iPhone app"""
     try:
-        character_map = get_available_characters()
-        
-        # Convert integer keys to string keys for JSON compatibility
-        character_map_str = {str(k): v for k, v in character_map.items()}
+        _, character_map_str = get_character_listings()
         
         return CharacterMapResponse(
             character_map=character_map_str,
@@ -498,7 +691,7 @@ async def get_character_map():
         )
         
     except Exception as e:
-        logger.error(f"Get character map failed: {str(e)}")
+        logger.error("Get character map failed: %s", e)
         return CharacterMapResponse(
             character_map={},
             success=False,
@@ -506,7 +699,7 @@ async def get_character_map():
         )
 
 @app.get("/api/character/name")
-async def get_character_name_endpoint(character_id: int):
+def get_character_name_endpoint(character_id: int):
     """Get character name by ID for iPhone app"""
     try:
         if character_id is None:
@@ -515,7 +708,7 @@ async def get_character_name_endpoint(character_id: int):
                 "error": "character_id is required"
             }
         
-        character_name = get_character_name(character_id)
+        character_name = lookup_character_name(character_id)
         
         return {
             "type": "character_name",
@@ -525,14 +718,14 @@ async def get_character_name_endpoint(character_id: int):
         }
         
     except Exception as e:
-        logger.error(f"Get character name failed: {str(e)}")
+        logger.error("Get character name failed: %s", e)
         return {
             "success": False,
             "error": str(e)
         }
 
 @app.get("/api/cache/status", response_model=CacheStatusResponse)
-async def get_cache_status():
+def get_cache_status():
     """Get cache status for debugging"""
     try:
         cache_info = feishu_service.get_cache_info()
@@ -543,60 +736,62 @@ async def get_cache_status():
         )
         
     except Exception as e:
-        logger.error(f"Get cache status failed: {str(e)}")
+        logger.error("Get cache status failed: %s", e)
         return CacheStatusResponse(
             cache_info={},
             success=False,
             error=str(e)
         )
 
-@app.post("/api/tts", response_model=TTSResponse)
-async def text_to_speech(request: TTSRequest):
+@app.post("/api/tts", response_model=None, responses={200: {"model": TTSResponse}})
+def text_to_speech(request: TTSRequest):
     """Text-to-speech endpoint (iPhone handles actual TTS)"""
+    timestamp = datetime.now().isoformat()
     try:
         if not request.text:
-            return TTSResponse(
-                type="error",
-                text="",
-                character_id=0,
-                character_name="",
-                voice_id="",
-                message="text is required for text_to_speech request",
-                timestamp=datetime.now().isoformat(),
-                success=False,
-                error="text is required"
-            )
+            return orjson_response({
+                "type": "error",
+                "text": "",
+                "character_id": 0,
+                "character_name": "",
+                "voice_id": "",
+                "message": "text is required for text_to_speech request",
+                "timestamp": timestamp,
+                "success": False,
+                "error": "text is required"
+            })
         
         # Get character info
-        character_name = get_character_name(request.character_id)
-        voice_id = get_character_voice_id(request.character_id)
+        character_name = lookup_character_name(request.character_id)
+        voice_id = lookup_character_voice_id(request.character_id)
         
-        logger.info(f"TTS request: text={request.text[:30]}..., character_id={request.character_id}")
+        logger.info("TTS request: text=%s..., character_id=%s", request.text[:30], request.character_id)
         
-        return TTSResponse(
-            type="tts_info",
-            text=request.text,
-            character_id=request.character_id,
-            character_name=character_name,
-            voice_id=voice_id,
-            message="TTS should be handled on iPhone side",
-            timestamp=datetime.now().isoformat(),
-            success=True
-        )
+        return orjson_response({
+            "type": "tts_info",
+            "text": request.text,
+            "character_id": request.character_id,
+            "character_name": character_name,
+            "voice_id": voice_id,
+            "message": "TTS should be handled on iPhone side",
+            "timestamp": timestamp,
+            "success": True,
+            "error": None
+        })
         
     except Exception as e:
-        logger.error(f"TTS request failed: {str(e)}")
-        return TTSResponse(
-            type="error",
-            text="",
-            character_id=0,
-            character_name="",
-            voice_id="",
-            message="TTS request failed",
-            timestamp=datetime.now().isoformat(),
-            success=False,
-            error=str(e)
-        )
+        logger.error("TTS request failed: %s", e)
+        return orjson_response({
+            "type": "error",
+            "text": "",
+            "character_id": 0,
+            "character_name": "",
+            "voice_id": "",
+            "message": "TTS request failed",
+            "timestamp": timestamp,
+            "success": False,
+            "error": str(e)
+        })
 
 # Error handlers
 @app.exception_handler(HTTPException)
@@ -608,7 +803,7 @@ async def http_exception_handler(request: Request, exc: HTTPException):
 
 @app.exception_handler(Exception)
 async def general_exception_handler(request: Request, exc: Exception):
-    logger.error(f"Unhandled exception: {str(exc)}")
+    logger.error("Unhandled exception: %s", exc)
     return JSONResponse(
         status_code=500,
         content={"success": False, "error": "Internal server error"}
@@ -618,14 +813,23 @@ if __name__ == "__main__":
     # Configuration
     HOST = "145.79.12.177"
     PORT = 10000  # Use different port to avoid conflict with WebSocket server
+    # Auto-reload on file changes, for development only
+    RELOAD = os.getenv("HTTP_SERVER_RELOAD", "0") == "1"
+    # Run on uvloop with the httptools parser; uvloop does not support Windows
+    LOOP = "asyncio" if sys.platform == "win32" else "uvloop"
+    HTTP = "httptools"
+    missing = [name for name in (LOOP, HTTP) if name != "asyncio" and importlib.util.find_spec(name) is None]
+    if missing:
+        raise SystemExit(f"Missing required server packages: {', '.join(missing)} (pip install {' '.join(missing)})")
     
-    logger.info(f"Starting HTTP server on {HOST}:{PORT}")
+    logger.info("Starting HTTP server on %s:%s (event loop: %s, HTTP parser: %s)", HOST, PORT, LOOP, HTTP)
     logger.info("影聲 NFC Reader HTTP API Server")
     logger.info("Available endpoints:")
     logger.info("  GET  /                 - Health check")
     logger.info("  GET  /api/ping        - Connection test")
     logger.info("  POST /api/chat         - LLM chat (text/gemini_chat)")
     logger.info("  POST /api/character    - Get character info")
+    logger.info("  POST /api/characters/batch - Get info for several characters")
     logger.info("  POST /api/character/set - Set current character")
     logger.info("  GET  /api/character/map - Get character map")
     logger.info("  GET  /api/character/name - Get character name")
@@ -635,11 +839,13 @@ if __name__ == "__main__":
     logger.info("  POST /api/tts          - Text-to-speech info")
     logger.info("  GET  /api/cache/status - Cache status")
     
-    # Run the server
+    # Run the server (single process; see the module docstring for gunicorn workers)
     uvicorn.run(
         "http_server:app",  # Use import string for reload support
         host=HOST,
         port=PORT,
+        loop=LOOP,
+        http=HTTP,
         log_level="info",
-        reload=True  # Enable for development
+        reload=RELOAD
     )
\ No newline at end of file